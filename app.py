@@ -1,48 +1,232 @@
 
 import streamlit as st
 import pandas as pd
+import numpy as np
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
 import plotly.express as px
+import plotly.io as pio
 from datetime import datetime
 
 st.set_page_config(layout="wide", page_title="LULU UAE Sales Dashboard")
 
+# Columns the dashboard reads from each file; files not listed here are loaded in full
+# (transactions.csv stays whole because the CSV export hands every source column back to the user)
+NEEDED_COLS = {
+    "ad_budget_monthly.csv": ['month','category','ad_budget_aed'],
+}
+
+# Source columns of transactions.csv; the CSV export writes exactly these, never derived helper columns
+TRANSACTION_COLS = ['transaction_id','transaction_datetime','customer_id','age','gender','emirate','category','product','quantity','unit_price_aed','total_aed','has_loyalty','offer_applied','points_earned','points_redeemed']
+
+def source_path(path):
+    # Prefer the Parquet copy written by convert_to_parquet.py, unless the CSV was edited after it
+    parquet_path = path.replace('.csv', '.parquet')
+    if os.path.exists(parquet_path) and os.path.getmtime(parquet_path) >= os.path.getmtime(path):
+        return parquet_path
+    return path
+
+def read_source(path, **csv_kwargs):
+    src = source_path(path)
+    if src.endswith('.parquet'):
+        return pq.read_table(src, columns=NEEDED_COLS.get(path), memory_map=True).to_pandas()
+    return pd.read_csv(path, engine='pyarrow', usecols=NEEDED_COLS.get(path), **csv_kwargs)
+
+def source_mtime(path):
+    # Passed into the loaders as part of their cache key, so editing or converting a file invalidates the disk cache
+    return os.path.getmtime(source_path(path))
+
+@st.cache_data(persist="disk", max_entries=4)
+def load_data(path, mtime):
+    return read_source(path)
+
+@st.cache_data(persist="disk", max_entries=4)
+def load_transactions(path, mtime):
+    df = read_source(path, parse_dates=['transaction_datetime'])
+    for c in ('emirate', 'category', 'gender', 'product'):
+        df[c] = df[c].astype('category')
+    df['has_loyalty'] = df['has_loyalty'].astype(bool)
+    df['month'] = df['transaction_datetime'].values.astype('datetime64[M]').astype(str)
+    df['transaction_code'] = pd.factorize(df['transaction_id'])[0]
+    return df
+
 @st.cache_data
-def load_data(path):
-    return pd.read_csv(path)
+def get_filter_options(path, mtime):
+    df = load_transactions(path, mtime)
+    return {
+        'emirates': df['emirate'].unique().tolist(),
+        'categories': df['category'].unique().tolist(),
+        'gender': df['gender'].unique().tolist(),
+        'min_date': df['transaction_datetime'].min(),
+        'max_date': df['transaction_datetime'].max(),
+    }
+
+@st.cache_data(max_entries=64)
+def filter_transactions(mtime, date_range, emirates, categories, genders, loyalty_filter):
+    df = load_transactions("transactions.csv", mtime)
+    start, end = pd.to_datetime(date_range[0]), pd.to_datetime(date_range[1]) + pd.Timedelta(days=1)
+    dt = df['transaction_datetime'].values
+    mask = (dt >= start.to_datetime64()) & (dt < end.to_datetime64())
+    mask &= df['emirate'].isin(emirates).values
+    mask &= df['category'].isin(categories).values
+    mask &= df['gender'].isin(genders).values
+    if loyalty_filter=="Loyalty Members":
+        mask &= df['has_loyalty'].values
+    elif loyalty_filter=="Non-members":
+        mask &= ~df['has_loyalty'].values
+    return df.loc[mask]
+
+def agg_kpis(df):
+    kpis = df['total_aed'].agg(['sum','mean'])
+    # Distinct transactions via the integer codes from load_transactions
+    total_transactions = np.count_nonzero(np.bincount(df['transaction_code'].values))
+    return {'total_sales': kpis['sum'], 'total_transactions': total_transactions, 'avg_basket': kpis['mean']}
+
+def agg_age(df):
+    # Right-closed bins (-inf,25], (25,35], (35,45], (45,55], (55,65], (65,inf): ages outside 18-80
+    # fall into the first or last group rather than being dropped
+    age_idx = np.digitize(df['age'].values, [25,35,45,55,65], right=True)
+    age_sales = np.bincount(age_idx, weights=df['total_aed'].values, minlength=6)
+    return pd.DataFrame({'age_group': ["18-24","25-34","35-44","45-54","55-64","65+"], 'total_aed': age_sales})
+
+def agg_gender(df):
+    # sort=True keeps slice order, and so px.pie's colours, fixed whatever the filters
+    return df.groupby('gender', observed=True, sort=True)['total_aed'].sum().reset_index()
+
+def agg_cat_em(df):
+    # Emirate x category sales in one pass over the categorical codes
+    em_labels, cat_labels = df['emirate'].cat.categories, df['category'].cat.categories
+    n_cat = len(cat_labels)
+    em_cat_key = df['emirate'].cat.codes.to_numpy(np.intp) * n_cat + df['category'].cat.codes.to_numpy(np.intp)
+    em_cat_sales = np.bincount(em_cat_key, weights=df['total_aed'].values, minlength=len(em_labels) * n_cat)
+    observed_keys = np.flatnonzero(np.bincount(em_cat_key, minlength=len(em_labels) * n_cat))
+    return pd.DataFrame({'emirate': em_labels[observed_keys // n_cat], 'category': cat_labels[observed_keys % n_cat], 'total_aed': em_cat_sales[observed_keys]})
+
+def agg_loyal(df):
+    # Distinct transactions per loyalty group, marked on the integer transaction codes
+    codes = df['transaction_code'].values
+    tid_seen = np.zeros((2, codes.max(initial=-1) + 1), dtype=bool)
+    tid_seen[df['has_loyalty'].values.astype(np.intp), codes] = True
+    # sort=True keeps the bar order fixed (Non-members, then Members) whatever the filters
+    loyal = df.groupby('has_loyalty', observed=True, sort=True).agg(total_sales=('total_aed','sum'), avg_basket=('total_aed','mean'))
+    loyal['transactions'] = tid_seen.sum(axis=1)[loyal.index.to_numpy().astype(np.intp)]
+    return loyal.reset_index()
+
+def agg_sales_month_cat(df):
+    return df.groupby(['month','category'], observed=True, sort=False)['total_aed'].sum().reset_index()
+
+def agg_redeem(df):
+    return df[df['points_redeemed']>0].groupby('customer_id', observed=True, sort=False).agg(points_redeemed=('points_redeemed','sum'), sales_after_redeem=('total_aed','sum')).reset_index()
 
-transactions = load_data("transactions.csv")
-customers = load_data("customers_demographics.csv")
-loyalty = load_data("loyalty_program.csv")
-ad_budget = load_data("ad_budget_monthly.csv")
+def agg_top_products(df):
+    return df.groupby(['category','product'], observed=True, sort=False).agg(sales=('total_aed','sum'), qty=('quantity','sum')).nlargest(15, 'sales').reset_index()
+
+AGG_FUNCS = {
+    'kpis': agg_kpis,
+    'age_dist': agg_age,
+    'gender_dist': agg_gender,
+    'cat_em': agg_cat_em,
+    'loyal': agg_loyal,
+    'sales_month_cat': agg_sales_month_cat,
+    'redeem_summary': agg_redeem,
+    'top_products': agg_top_products,
+}
+
+@st.cache_data(max_entries=64)
+def compute_aggs(mtime, date_range, emirates, categories, genders, loyalty_filter):
+    df = filter_transactions(mtime, date_range, emirates, categories, genders, loyalty_filter)
+    # The aggregations only read df, so they can run concurrently. This only pays off on large frames;
+    # at the bundled ~1200 rows thread start-up costs about as much as the groupbys themselves.
+    with ThreadPoolExecutor(max_workers=min(len(AGG_FUNCS), os.cpu_count() or 1)) as pool:
+        results = pool.map(lambda fn: fn(df), AGG_FUNCS.values())
+    return dict(zip(AGG_FUNCS, results))
+
+@st.cache_data(max_entries=64)
+def filtered_csv_bytes(mtime, date_range, emirates, categories, genders, loyalty_filter):
+    df = filter_transactions(mtime, date_range, emirates, categories, genders, loyalty_filter)[TRANSACTION_COLS]
+    # Format values the way transactions.csv stores them (True/False, microsecond timestamps, 45.0 not 45)
+    out = df.assign(
+        transaction_datetime=df['transaction_datetime'].dt.strftime('%Y-%m-%d %H:%M:%S.%f'),
+        **{c: df[c].astype(str) for c in ('unit_price_aed', 'total_aed', 'has_loyalty', 'offer_applied')},
+    )
+    buf = io.BytesIO()
+    pacsv.write_csv(pa.Table.from_pandas(out, preserve_index=False), buf, pacsv.WriteOptions(quoting_style="none"))
+    return buf.getvalue()
+
+@st.cache_data(max_entries=64)
+def build_figures(ad_mtime, mtime, date_range, emirates, categories, genders, loyalty_filter):
+    aggs = compute_aggs(mtime, date_range, emirates, categories, genders, loyalty_filter)
+    figs = {}
+    figs['age'] = px.bar(aggs['age_dist'], x='age_group', y='total_aed', labels={'total_aed':'Sales (AED)','age_group':'Age group'}, title="Sales by Age Group")
+    figs['gender'] = px.pie(aggs['gender_dist'], names='gender', values='total_aed', title="Sales by Gender")
+    figs['cat'] = px.sunburst(aggs['cat_em'], path=['emirate','category'], values='total_aed', title="Sales by Emirate and Category")
+
+    loyal = aggs['loyal']
+    loyal['has_loyalty'] = np.where(loyal['has_loyalty'].to_numpy(), 'Members', 'Non-members')
+    figs['loyal'] = px.bar(loyal, x='has_loyalty', y='total_sales', text='avg_basket', labels={'total_sales':'Sales (AED)','has_loyalty':'Customer Type'}, title="Sales: Loyalty Members vs Non-members (avg basket shown)")
+
+    redeem_summary = aggs['redeem_summary']
+    if not redeem_summary.empty:
+        figs['redeem'] = px.scatter(redeem_summary, x='points_redeemed', y='sales_after_redeem', hover_data=['customer_id'], title="Points Redeemed vs Sales (per customer)")
+
+    # Ad budget vs sales (monthly)
+    ad = load_data("ad_budget_monthly.csv", ad_mtime)
+    merged = pd.merge(ad, aggs['sales_month_cat'], on=['month','category'], how='left').fillna(0)
+
+    # Reshape for dual metric plotting
+    long_df = merged.melt(
+        id_vars=['month','category'],
+        value_vars=['ad_budget_aed','total_aed'],
+        var_name='metric',
+        value_name='value'
+    )
+
+    figs['ad'] = px.line(
+        long_df,
+        x='month',
+        y='value',
+        color='category',
+        line_dash='metric',
+        title="Ad Budget vs Sales by Category"
+    )
+
+    figs['top'] = px.bar(aggs['top_products'], x='product', y='sales', color='category', title="Top selling products (by sales)")
+    # Figures are cached as JSON and rebuilt with pio.from_json on each rerun
+    return {name: fig.to_json() for name, fig in figs.items()}
+
+customers = load_data("customers_demographics.csv", source_mtime("customers_demographics.csv"))
+loyalty = load_data("loyalty_program.csv", source_mtime("loyalty_program.csv"))
 
 st.title("LULU Hypermarket — UAE Sales & Loyalty Dashboard")
 
 # Sidebar filters
 st.sidebar.header("Filters")
-min_date = pd.to_datetime(transactions['transaction_datetime']).min()
-max_date = pd.to_datetime(transactions['transaction_datetime']).max()
-date_range = st.sidebar.date_input("Transaction date range", [min_date.date(), max_date.date()])
-
-selected_emirates = st.sidebar.multiselect("Emirates", options=transactions['emirate'].unique().tolist(), default=transactions['emirate'].unique().tolist())
-selected_categories = st.sidebar.multiselect("Categories", options=transactions['category'].unique().tolist(), default=transactions['category'].unique().tolist())
-gender = st.sidebar.multiselect("Gender", options=transactions['gender'].unique().tolist(), default=transactions['gender'].unique().tolist())
-loyalty_filter = st.sidebar.selectbox("Loyalty filter", options=["All","Loyalty Members","Non-members"])
-
-# Apply filters
-df = transactions.copy()
-df['transaction_datetime'] = pd.to_datetime(df['transaction_datetime'])
-start, end = pd.to_datetime(date_range[0]), pd.to_datetime(date_range[1]) + pd.Timedelta(days=1)
-df = df[(df['transaction_datetime']>=start) & (df['transaction_datetime']<end)]
-df = df[df['emirate'].isin(selected_emirates) & df['category'].isin(selected_categories) & df['gender'].isin(gender)]
-if loyalty_filter=="Loyalty Members":
-    df = df[df['has_loyalty']==True]
-elif loyalty_filter=="Non-members":
-    df = df[df['has_loyalty']==False]
+filter_options = get_filter_options("transactions.csv", source_mtime("transactions.csv"))
+min_date, max_date = filter_options['min_date'], filter_options['max_date']
+# Widgets inside the form only trigger a rerun when "Apply" is pressed
+with st.sidebar.form("filters"):
+    date_range = st.date_input("Transaction date range", [min_date.date(), max_date.date()])
+
+    selected_emirates = st.multiselect("Emirates", options=filter_options['emirates'], default=filter_options['emirates'])
+    selected_categories = st.multiselect("Categories", options=filter_options['categories'], default=filter_options['categories'])
+    gender = st.multiselect("Gender", options=filter_options['gender'], default=filter_options['gender'])
+    loyalty_filter = st.selectbox("Loyalty filter", options=["All","Loyalty Members","Non-members"])
+    st.form_submit_button("Apply")
+
+# Apply filters (lists become tuples so the cached functions can hash them; the file mtime
+# is part of the state so cached results are rebuilt after transactions.csv changes)
+filter_state = (source_mtime("transactions.csv"), tuple(date_range), tuple(selected_emirates), tuple(selected_categories), tuple(gender), loyalty_filter)
+aggs = compute_aggs(*filter_state)
+figs = build_figures(source_mtime("ad_budget_monthly.csv"), *filter_state)
 
 # KPIs
-total_sales = df['total_aed'].sum()
-total_transactions = df['transaction_id'].nunique()
-avg_basket = df['total_aed'].mean()
+total_sales = aggs['kpis']['total_sales']
+total_transactions = aggs['kpis']['total_transactions']
+avg_basket = aggs['kpis']['avg_basket']
 st.metric("Total Sales (AED)", f"{total_sales:,.2f}", delta=None)
 st.metric("Transactions", f"{total_transactions}", delta=None)
 st.metric("Avg Basket (AED)", f"{avg_basket:,.2f}", delta=None)
@@ -51,71 +235,31 @@ st.metric("Avg Basket (AED)", f"{avg_basket:,.2f}", delta=None)
 col1, col2 = st.columns([1,2])
 with col1:
     st.subheader("Customer Demographics")
-    age_bins = [18,25,35,45,55,65,80]
-    df['age_group'] = pd.cut(df['age'], bins=age_bins, labels=["18-24","25-34","35-44","45-54","55-64","65+"], include_lowest=True)
-    age_dist = df.groupby('age_group')['total_aed'].sum().reset_index()
-    fig_age = px.bar(age_dist, x='age_group', y='total_aed', labels={'total_aed':'Sales (AED)','age_group':'Age group'}, title="Sales by Age Group")
-    st.plotly_chart(fig_age, use_container_width=True)
-
-    gender_dist = df.groupby('gender')['total_aed'].sum().reset_index()
-    fig_gender = px.pie(gender_dist, names='gender', values='total_aed', title="Sales by Gender")
-    st.plotly_chart(fig_gender, use_container_width=True)
+    st.plotly_chart(pio.from_json(figs['age']), use_container_width=True)
+    st.plotly_chart(pio.from_json(figs['gender']), use_container_width=True)
 
 with col2:
     st.subheader("Category performance by emirate")
-    cat_em = df.groupby(['emirate','category'])['total_aed'].sum().reset_index()
-    fig_cat = px.sunburst(cat_em, path=['emirate','category'], values='total_aed', title="Sales by Emirate and Category")
-    st.plotly_chart(fig_cat, use_container_width=True)
+    st.plotly_chart(pio.from_json(figs['cat']), use_container_width=True)
 
 # Loyalty program impact
 st.subheader("Loyalty Program Impact")
-loyal = df.groupby('has_loyalty').agg(total_sales=('total_aed','sum'), transactions=('transaction_id','nunique'), avg_basket=('total_aed','mean')).reset_index()
-loyal['has_loyalty'] = loyal['has_loyalty'].map({True:'Members', False:'Non-members'})
-fig_loyal = px.bar(loyal, x='has_loyalty', y='total_sales', text='avg_basket', labels={'total_sales':'Sales (AED)','has_loyalty':'Customer Type'}, title="Sales: Loyalty Members vs Non-members (avg basket shown)")
-st.plotly_chart(fig_loyal, use_container_width=True)
+st.plotly_chart(pio.from_json(figs['loyal']), use_container_width=True)
 
 # Points redeemed vs sales
-redeem = df[df['points_redeemed']>0]
-if not redeem.empty:
-    redeem_summary = redeem.groupby('customer_id').agg(points_redeemed=('points_redeemed','sum'), sales_after_redeem=('total_aed','sum')).reset_index()
-    fig_redeem = px.scatter(redeem_summary, x='points_redeemed', y='sales_after_redeem', hover_data=['customer_id'], title="Points Redeemed vs Sales (per customer)")
-    st.plotly_chart(fig_redeem, use_container_width=True)
+if 'redeem' in figs:
+    st.plotly_chart(pio.from_json(figs['redeem']), use_container_width=True)
 else:
     st.info("No point-redemption transactions in the selected filters.")
 
 # Ad budget vs sales (monthly)
 st.subheader("Advertising Budget vs Sales (last 12 months)")
-monthly_sales = df.copy()
-monthly_sales['month'] = monthly_sales['transaction_datetime'].dt.to_period('M').astype(str)
-sales_month_cat = monthly_sales.groupby(['month','category'])['total_aed'].sum().reset_index()
-ad = ad_budget.copy()
-merged = pd.merge(ad, sales_month_cat, on=['month','category'], how='left').fillna(0)
-
-# Reshape for dual metric plotting
-long_df = merged.melt(
-    id_vars=['month','category'],
-    value_vars=['ad_budget_aed','total_aed'],
-    var_name='metric',
-    value_name='value'
-)
-
-fig_ad = px.line(
-    long_df,
-    x='month',
-    y='value',
-    color='category',
-    line_dash='metric',
-    title="Ad Budget vs Sales by Category"
-)
-st.plotly_chart(fig_ad, use_container_width=True)
+st.plotly_chart(pio.from_json(figs['ad']), use_container_width=True)
 
 # Top products
 st.subheader("Top Products")
-top_products = df.groupby(['category','product']).agg(sales=('total_aed','sum'), qty=('quantity','sum')).reset_index().sort_values('sales', ascending=False).head(15)
-fig_top = px.bar(top_products, x='product', y='sales', color='category', title="Top selling products (by sales)")
-st.plotly_chart(fig_top, use_container_width=True)
+st.plotly_chart(pio.from_json(figs['top']), use_container_width=True)
 
-# Download sample filtered data
+# Download sample filtered data (the CSV bytes are built, and cached, for each new filter state)
 st.sidebar.markdown("### Export")
-if st.sidebar.button("Download filtered transactions CSV"):
-    st.sidebar.download_button("Click to download", data=df.to_csv(index=False), file_name="filtered_transactions.csv", mime="text/csv")
+st.sidebar.download_button("Download filtered transactions CSV", data=filtered_csv_bytes(*filter_state), file_name="filtered_transactions.csv", mime="text/csv")
@@ -0,0 +1,19 @@
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# One-time conversion of the dashboard CSVs to Parquet (run: python convert_to_parquet.py).
+# app.py / new_app.py read the .parquet copy when it exists and fall back to the CSV otherwise.
+FILES = ["transactions.csv", "customers_demographics.csv", "loyalty_program.csv", "ad_budget_monthly.csv", "product_catalog.csv"]
+DATE_COLS = {"transactions.csv": ['transaction_datetime']}
+# Stored as dictionary columns so they load back as pandas categoricals
+CATEGORY_COLS = {"transactions.csv": ['emirate', 'category', 'gender', 'product']}
+
+for path in FILES:
+    df = pd.read_csv(path, engine='pyarrow', parse_dates=DATE_COLS.get(path))
+    for c in CATEGORY_COLS.get(path, []):
+        df[c] = df[c].astype('category')
+    out = path.replace('.csv', '.parquet')
+    pq.write_table(pa.Table.from_pandas(df, preserve_index=False), out)
+    print(f"{path} -> {out} ({len(df)} rows)")